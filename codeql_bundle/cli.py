@@ -1,22 +1,27 @@
-# Add the parent directory to the path if this module is run directly (i.e. not imported)
-# This is necessary to support both the Poetry script invocation and the direct invocation.
-if not __package__ and __name__ == "__main__":
-    import sys
-    from pathlib import Path
-
-    sys.path.append(str(Path(__file__).parent.parent))
-    __package__ = Path(__file__).parent.name
-
 import click
 from pathlib import Path
-from codeql_bundle.helpers.codeql import CodeQLException
-from codeql_bundle.helpers.bundle import CustomBundle, BundleException, BundlePlatform
-from typing import List, Optional
+from typing import List, Optional, FrozenSet, Tuple
 import sys
 import logging
 
 logger = logging.getLogger(__name__)
 
+_LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+_LOG_FORMATS = {"DEBUG": "%(levelname)s:%(asctime)s %(message)s"}
+_DEFAULT_LOG_FORMAT = "%(levelname)s: %(message)s"
+_LOGLEVEL_CHOICES = tuple(_LOG_LEVELS)
+_PLATFORM_CHOICES = ("linux64", "osx64", "win64")
+_COMPRESSION_CHOICES = ("gzip", "zstd", "none")
+
+def _as_frozenset(ctx: click.Context, param: click.Parameter, value: Tuple[str, ...]) -> FrozenSet[str]:
+    return frozenset(value)
+
 @click.command()
 @click.option(
     "-b",
@@ -30,7 +35,7 @@ logger = logging.getLogger(__name__)
     "-o",
     "--output",
     required=True,
-    help="Path to store the custom CodeQL bundle. Can be a directory or a non-existing archive ending with the extension '.tar.gz' if there is only a single bundle",
+    help="Path to store the custom CodeQL bundle. Can be a directory or a non-existing archive ending with the extension '.tar.gz' (or '.tar.zst' or '.tar' for the corresponding compression) if there is only a single bundle",
     type=click.Path(path_type=Path),
 )
 @click.option(
@@ -44,14 +49,18 @@ logger = logging.getLogger(__name__)
     "-l",
     "--log",
     "loglevel",
-    type=click.Choice(
-        ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], case_sensitive=False
-    ),
+    type=click.Choice(_LOGLEVEL_CHOICES, case_sensitive=False),
     default="WARNING",
 )
-@click.option("-p", "--platform", multiple=True, type=click.Choice(["linux64", "osx64", "win64"], case_sensitive=False), help="Target platform for the bundle")
+@click.option("-p", "--platform", multiple=True, type=click.Choice(_PLATFORM_CHOICES, case_sensitive=False), help="Target platform for the bundle")
 @click.option("-c", "--code-scanning-config", type=click.Path(exists=True, path_type=Path), help="Path to a Code Scanning configuration file that will be the default for the bundle")
-@click.argument("packs", nargs=-1, required=True)
+@click.option(
+    "--compression",
+    type=click.Choice(_COMPRESSION_CHOICES, case_sensitive=False),
+    default="gzip",
+    help="Compression of the custom CodeQL bundle(s). 'zstd' requires the 'zstd' command, and 'none' creates an uncompressed archive that is faster to create, but larger",
+)
+@click.argument("packs", nargs=-1, required=True, callback=_as_frozenset)
 def main(
     bundle_path: Path,
     output: Path,
@@ -59,46 +68,52 @@ def main(
     loglevel: str,
     platform: List[str],
     code_scanning_config: Optional[Path],
-    packs: List[str],
+    compression: str,
+    packs: FrozenSet[str],
 ) -> None:
 
-    if loglevel == "DEBUG":
-        logging.basicConfig(
-            format="%(levelname)s:%(asctime)s %(message)s",
-            level=getattr(logging, loglevel.upper()),
-        )
-    else:
-        logging.basicConfig(
-            format="%(levelname)s: %(message)s",
-            level=getattr(logging, loglevel.upper()),
-        )
-
-    if workspace.name == "codeql-workspace.yml":
+    # Click normalizes case-insensitive choices to the values in _LOGLEVEL_CHOICES.
+    logging.basicConfig(
+        format=_LOG_FORMATS.get(loglevel, _DEFAULT_LOG_FORMAT),
+        level=_LOG_LEVELS[loglevel],
+    )
+
+    # Defer loading the helpers until the arguments are parsed so that '--help' and argument validation errors
+    # don't pay for importing them.
+    from codeql_bundle.helpers.codeql import CodeQLException
+    from codeql_bundle.helpers.bundle import CustomBundle, BundleException, BundlePlatform, BundleCompression
+
+    # The workspace option accepts either a directory or the workspace file it contains.
+    if workspace.is_file():
         workspace = workspace.parent
 
     logger.info(
-        f"Creating custom bundle of {bundle_path} using CodeQL pack(s) in workspace {workspace}"
+        "Creating custom bundle of %s using CodeQL pack(s) in workspace %s", bundle_path, workspace
     )
 
     try:
         bundle = CustomBundle(bundle_path, workspace)
 
-        unsupported_platforms = list(filter(lambda p: not bundle.supports_platform(BundlePlatform.from_string(p)), platform))
+        parsed_platforms = [(p, BundlePlatform.from_string(p)) for p in platform]
+        supported_platforms = bundle.platforms
+        unsupported_platforms = [p for p, bundle_platform in parsed_platforms if bundle_platform not in supported_platforms]
         if len(unsupported_platforms) > 0:
             logger.fatal(
-                f"The provided bundle supports the platform(s) {', '.join(map(str, bundle.platforms))}, but doesn't support the following platform(s): {', '.join(unsupported_platforms)}"
+                "The provided bundle supports the platform(s) %s, but doesn't support the following platform(s): %s",
+                ", ".join(map(str, supported_platforms)),
+                ", ".join(unsupported_platforms),
             )
             sys.exit(1)
 
-        logger.info(f"Looking for CodeQL packs in workspace {workspace}")
+        logger.info("Looking for CodeQL packs in workspace %s", workspace)
         packs_in_workspace = bundle.get_workspace_packs()
-        logger.info(
-            f"Found the CodeQL pack(s): {','.join(map(lambda p: p.config.name, packs_in_workspace))}"
-        )
-
-        logger.info(
-            f"Considering the following CodeQL pack(s) for inclusion in the custom bundle: {','.join(packs)}"
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Found the CodeQL pack(s): %s", ",".join(p.config.name for p in packs_in_workspace)
+            )
+            logger.info(
+                "Considering the following CodeQL pack(s) for inclusion in the custom bundle: %s", ",".join(packs)
+            )
 
         if len(packs) > 0:
             selected_packs = [
@@ -109,30 +124,31 @@ def main(
         else:
             selected_packs = packs_in_workspace
 
-        
-        missing_packs = set(packs) - {pack.config.name for pack in selected_packs}
+        missing_packs = packs - {pack.config.name for pack in selected_packs}
         if len(missing_packs) > 0:
             logger.fatal(
-                f"The provided CodeQL workspace doesn't contain the provided pack(s) '{','.join(missing_packs)}'",
+                "The provided CodeQL workspace doesn't contain the provided pack(s) '%s'", ",".join(missing_packs)
             )
             sys.exit(1)
 
-        logger.info(
-            f"Adding the pack(s) {','.join(map(lambda p: p.config.name, selected_packs))} and its workspace dependencies to the custom bundle."
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Adding the pack(s) %s and its workspace dependencies to the custom bundle.",
+                ",".join(p.config.name for p in selected_packs),
+            )
         bundle.add_packs(*selected_packs)
         if code_scanning_config:
-            logger.info(f"Adding the Code Scanning configuration file {code_scanning_config} to the custom bundle.")
+            logger.info("Adding the Code Scanning configuration file %s to the custom bundle.", code_scanning_config)
             bundle.add_code_scanning_config(code_scanning_config)
-        logger.info(f"Bundling custom bundle(s) at {output}")
-        platforms = set(map(BundlePlatform.from_string, platform))
-        bundle.bundle(output, platforms)
-        logger.info(f"Completed building of custom bundle(s).")
+        logger.info("Bundling custom bundle(s) at %s", output)
+        platforms = {bundle_platform for _, bundle_platform in parsed_platforms}
+        bundle.bundle(output, platforms, compression=BundleCompression.from_string(compression))
+        logger.info("Completed building of custom bundle(s).")
     except CodeQLException as e:
-        logger.fatal(f"Failed executing CodeQL command with reason: '{e}'")
+        logger.fatal("Failed executing CodeQL command with reason: '%s'", e)
         sys.exit(1)
     except BundleException as e:
-        logger.fatal(f"Failed to build custom bundle with reason: '{e}'")
+        logger.fatal("Failed to build custom bundle with reason: '%s'", e)
         sys.exit(1)
 
 
@@ -1,59 +1,139 @@
 from .codeql import (
     CodeQL,
     CodeQLException,
-    CodeQLPack
+    CodeQLPack,
+    SafeDumper,
+    SafeLoader,
 )
 from pathlib import Path
 from tempfile import TemporaryDirectory
 import tarfile
-from typing import List, cast, Callable, Optional
-from collections import defaultdict
+import gzip
+import zlib
+import io
+from typing import List, cast, Callable, Optional, Iterator, Dict, Any, IO
+from collections import defaultdict, deque
 import shutil
+import os
+import re
 import yaml
 import dataclasses
+import copy
 import logging
+from functools import cached_property
 from enum import Enum, verify, UNIQUE
 from dataclasses import dataclass
-from graphlib import TopologicalSorter
+try:
+    # Prefer the drop-in replacement implemented as a native extension when it is installed.
+    from graphlib2 import TopologicalSorter, CycleError
+except ImportError:
+    from graphlib import TopologicalSorter, CycleError
+from semantic_version import NpmSpec
 import platform
 import concurrent.futures
+import subprocess
+import itertools
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
+# Matches a top-level block style 'dependencies' mapping in a qlpack.yml file, including its (indented) entries and any
+# blank or comment lines between them. The match ends at the last indented line, so blank or comment lines that precede
+# the next top-level key are not part of it.
+DEPENDENCIES_BLOCK_PATTERN = re.compile(r"^dependencies:[ \t]*(?:#.*)?\n(?:(?:[ \t]*(?:#.*)?\n)*[ \t]+\S.*(?:\n|\Z))*", re.MULTILINE)
+
+# The buffer size used by tarfile to copy the contents of members from and to archives. Its default of 16KiB results in
+# many small reads and writes for the large jars and binaries in a bundle.
+TAR_COPY_BUFSIZE = 1 << 20
+
+# Each CodeQL CLI invocation runs its own JVM with its default heap, and 'codeql pack create' already compiles with a
+# thread per core. Only run a few invocations concurrently to overlap their single threaded and I/O bound phases without
+# oversubscribing the cores or the memory of the machine.
+MAX_CONCURRENT_CODEQL_INVOCATIONS = 2
+
 @verify(UNIQUE)
 class CodeQLPackKind(Enum):
     QUERY_PACK = 1
     LIBRARY_PACK = 2
     CUSTOMIZATION_PACK = 3
 
+# Source of the unique identifiers assigned to resolved packs.
+_pack_ids = itertools.count()
+
 @dataclass(kw_only=True, frozen=True, eq=True)
 class ResolvedCodeQLPack(CodeQLPack):
     kind: CodeQLPackKind
     dependencies: List["ResolvedCodeQLPack"] = dataclasses.field(default_factory=list)
+    # Unique per resolved pack (copies made with `dataclasses.replace` share the id of their original), so
+    # bookkeeping can be keyed by a cheap integer instead of the pack itself.
+    pack_id: int = dataclasses.field(compare=False)
 
     def __hash__(self):
-        return CodeQLPack.__hash__(self)
+        return self.pack_id
+
+    def __eq__(self, other: object) -> bool:
+        # Resolved packs are only created by the resolver, so the id and path identify a pack without comparing its
+        # configuration and (transitive) dependencies.
+        if not isinstance(other, ResolvedCodeQLPack):
+            return NotImplemented
+        return self.pack_id == other.pack_id and self.path == other.path
 
     def is_customizable(self) -> bool:
+        # Not cached, because adding customization support creates the module.
         return self.get_customizations_module_path().exists()
 
     def get_module_name(self) -> str:
-        return self.config.name.replace("-", "_").replace("/", ".")
+        return self._module_name
 
     def get_customizations_module_path(self) -> Path:
-        return self.path.parent / "Customizations.qll"
+        return self._customizations_module_path
 
     def get_lock_file_path(self) -> Path:
-        return self.path.parent / "codeql-pack.lock.yml"
+        return self._lock_file_path
 
     def get_dependencies_path(self) -> Path:
-        return self.path.parent / ".codeql"
+        return self._dependencies_path
 
     def get_cache_path(self) -> Path:
+        return self._cache_path
+
+    # The pack is immutable, so the derived name and paths are computed once on first use.
+    @cached_property
+    def _module_name(self) -> str:
+        return self.config.name.replace("-", "_").replace("/", ".")
+
+    @cached_property
+    def _customizations_module_path(self) -> Path:
+        return self.path.parent / "Customizations.qll"
+
+    @cached_property
+    def _lock_file_path(self) -> Path:
+        return self.path.parent / "codeql-pack.lock.yml"
+
+    @cached_property
+    def _dependencies_path(self) -> Path:
+        return self.path.parent / ".codeql"
+
+    @cached_property
+    def _cache_path(self) -> Path:
         return self.path.parent / ".cache"
 
     def is_stdlib_module(self) -> bool:
-        return self.config.get_scope() == "codeql"
+        return self.scope == "codeql"
+
+    @cached_property
+    def scope(self) -> Optional[str]:
+        return self.config.get_scope()
+
+    @cached_property
+    def pack_name(self) -> str:
+        return self.config.get_pack_name()
+
+    @cached_property
+    def qlpack_spec(self) -> Dict[str, Any]:
+        """The parsed contents of the pack's qlpack.yml. Treat as read-only, and make a copy before modifying it."""
+        with self.path.open("r") as fd:
+            return yaml.load(fd, Loader=SafeLoader)
 
 class BundleException(Exception):
     pass
@@ -68,6 +148,9 @@ def build_pack_resolver(packs: List[CodeQLPack], already_resolved_packs: List[Re
         candidates : dict[str, List[CodeQLPack]] = defaultdict(list)
         for pack in packs + already_resolved_packs:
             candidates[pack.config.name].append(pack)
+        # Order the candidates from the highest to the lowest version, so the first match is the best match.
+        for name in candidates:
+            candidates[name].sort(key=lambda p: p.config.version, reverse=True)
 
         def get_pack_kind(pack: CodeQLPack) -> CodeQLPackKind:
             kind = CodeQLPackKind.QUERY_PACK
@@ -82,38 +165,369 @@ def build_pack_resolver(packs: List[CodeQLPack], already_resolved_packs: List[Re
                     kind = CodeQLPackKind.LIBRARY_PACK
             return kind
 
+        # Many packs share dependencies with the same version constraints (e.g., on the standard library), so remember the
+        # best match per dependency name and constraint instead of scanning the candidates again.
+        matches: dict[tuple[str, NpmSpec], Optional[CodeQLPack]] = {}
+        def match(dep_name: str, dep_version: NpmSpec) -> Optional[CodeQLPack]:
+            key = (dep_name, dep_version)
+            if not key in matches:
+                matches[key] = next(
+                    (candidate_pack for candidate_pack in candidates[dep_name] if dep_version.match(candidate_pack.config.version)),
+                    None,
+                )
+            return matches[key]
+
+        # Determine the dependencies of each pack first, so we can resolve the packs in dependency order
+        # without recursing through the dependency graph.
+        pack_dependencies: dict[CodeQLPack, List[CodeQLPack]] = {}
+        pack_sorter: TopologicalSorter[CodeQLPack] = TopologicalSorter()
+        for pack in packs:
+            if pack in resolved_packs:
+                continue
+            logger.debug(f"Determining dependencies of pack {pack.config.name}@{pack.config.version}")
+            deps: List[CodeQLPack] = []
+            for dep_name, dep_version in pack.config.dependencies.items():
+                logger.debug(f"Resolving dependency {dep_name}:{dep_version}.")
+                dep = match(dep_name, dep_version)
+                if not dep:
+                    raise PackResolverException(f"Could not resolve dependency {dep_name}@{dep_version} for pack {pack.config.name}@{str(pack.config.version)}!")
+                logger.debug(f"Found candidate pack {dep.config.name}@{dep.config.version}.")
+                deps.append(dep)
+            pack_dependencies[pack] = deps
+            pack_sorter.add(pack, *[dep for dep in deps if not dep in resolved_packs])
+
+        try:
+            for pack in pack_sorter.static_order():
+                logger.debug(f"Resolving pack {pack.config.name}@{pack.config.version}")
+                resolved_deps = [resolved_packs[dep] for dep in pack_dependencies[pack]]
+                resolved_packs[pack] = ResolvedCodeQLPack(path=pack.path, config=pack.config, kind=get_pack_kind(pack), dependencies=resolved_deps, pack_id=next(_pack_ids))
+        except CycleError as e:
+            # The cycle is reported as a list of packs where each pack is a dependency of the next pack.
+            cycle: List[CodeQLPack] = e.args[1]
+            raise PackResolverException(f"Pack {cycle[0].config.name}@{str(cycle[0].config.version)} (transitively) depends on itself via {cycle[1].config.name}@{str(cycle[1].config.version)}!")
+
         def resolve(pack: CodeQLPack) -> ResolvedCodeQLPack:
-            def inner(pack_to_be_resolved: CodeQLPack) -> ResolvedCodeQLPack:
-                logger.debug(f"Resolving pack {pack_to_be_resolved.config.name}@{pack_to_be_resolved.config.version}")
-                if pack_to_be_resolved in resolved_packs:
-                    logger.debug(f"Resolved pack {pack_to_be_resolved.config.name}@{pack_to_be_resolved.config.version}, already resolved.")
-                    return resolved_packs[pack_to_be_resolved]
-                else:
-                    resolved_deps: List[ResolvedCodeQLPack] = []
-                    for dep_name, dep_version in pack_to_be_resolved.config.dependencies.items():
-                        logger.debug(f"Resolving dependency {dep_name}:{dep_version}.")
-                        resolved_dep = None
-                        for candidate_pack in candidates[dep_name]:
-                            logger.debug(f"Considering candidate pack {candidate_pack.config.name}@{candidate_pack.config.version}.")
-                            if candidate_pack == pack:
-                                raise PackResolverException(f"Pack {pack.config.name}@{str(pack.config.version)} (transitively) depends on itself via {pack_to_be_resolved.config.name}@{str(pack_to_be_resolved.config.version)}!")
-                            if dep_version.match(candidate_pack.config.version):
-                                logger.debug(f"Found candidate pack {candidate_pack.config.name}@{candidate_pack.config.version}.")
-                                resolved_dep = inner(candidate_pack)
-
-                        if not resolved_dep:
-                            raise PackResolverException(f"Could not resolve dependency {dep_name}@{dep_version} for pack {pack_to_be_resolved.config.name}@{str(pack_to_be_resolved.config.version)}!")
-                        resolved_deps.append(resolved_dep)
-
-
-                    resolved_pack = ResolvedCodeQLPack(path=pack_to_be_resolved.path, config=pack_to_be_resolved.config, kind=get_pack_kind(pack_to_be_resolved), dependencies=resolved_deps)
-                    resolved_packs[pack_to_be_resolved] = resolved_pack
-                    return resolved_pack
-            return inner(pack)
+            return resolved_packs[pack]
         return resolve
 
     return builder()
 
+class PackDependencyGraph:
+    """
+    A dependency graph of resolved packs that orders the packs such that each pack comes after its dependencies.
+    The bookkeeping is keyed by pack id, see `ResolvedCodeQLPack.pack_id`.
+    """
+    def __init__(self) -> None:
+        self.packs: dict[int, ResolvedCodeQLPack] = {}
+        # Adjacency lists from a pack to the packs that depend on it, together with the number of dependencies per pack.
+        # Packs are kept in the order they are added to get a stable order.
+        self.dependents: dict[int, List[int]] = {}
+        self.dependency_count: dict[int, int] = {}
+
+    def __contains__(self, pack: ResolvedCodeQLPack) -> bool:
+        return pack.pack_id in self.packs
+
+    def _add_node(self, pack: ResolvedCodeQLPack) -> None:
+        if not pack.pack_id in self.packs:
+            self.packs[pack.pack_id] = pack
+            self.dependents[pack.pack_id] = []
+            self.dependency_count[pack.pack_id] = 0
+
+    def add(self, pack: ResolvedCodeQLPack, *deps: ResolvedCodeQLPack) -> None:
+        """Add the pack and its dependencies `deps` to the graph, like `graphlib.TopologicalSorter.add`."""
+        self._add_node(pack)
+        for dep in deps:
+            self._add_node(dep)
+            # An edge can be added more than once, but must only be counted once.
+            if not pack.pack_id in self.dependents[dep.pack_id]:
+                self.dependents[dep.pack_id].append(pack.pack_id)
+                self.dependency_count[pack.pack_id] += 1
+
+    def static_order(self) -> List[List[ResolvedCodeQLPack]]:
+        """
+        Order the packs in the graph such that each pack comes after its dependencies (Kahn's algorithm).
+        The packs are grouped in levels, where the packs in a level only depend on packs in the preceding levels.
+        """
+        remaining_dependency_count = dict(self.dependency_count)
+        ready = [pack_id for pack_id, count in remaining_dependency_count.items() if count == 0]
+        order: List[List[ResolvedCodeQLPack]] = []
+        ordered_pack_count = 0
+        while ready:
+            order.append([self.packs[pack_id] for pack_id in ready])
+            ordered_pack_count += len(ready)
+            next_ready: List[int] = []
+            for pack_id in ready:
+                for dependent_id in self.dependents[pack_id]:
+                    remaining_dependency_count[dependent_id] -= 1
+                    if remaining_dependency_count[dependent_id] == 0:
+                        next_ready.append(dependent_id)
+            ready = next_ready
+        if ordered_pack_count != len(self.packs):
+            cyclic_packs = [self.packs[pack_id] for pack_id, count in remaining_dependency_count.items() if count > 0]
+            raise BundleException(f"Unable to determine the order in which to bundle the packs, because the packs {', '.join(p.config.name for p in cyclic_packs)} have a cyclic dependency!")
+        return order
+
+def link_or_copy(src: str, dst: str) -> None:
+    """
+    Create a hard link `dst` to the file `src`, or copy the file if the file system doesn't allow the link.
+    This can be used as the `copy_function` of `shutil.copytree`.
+
+    The file `dst` must be replaced, not modified, to leave `src` untouched. See `open_for_rewrite`.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+def fast_copytree(src: Path, dst: Path) -> None:
+    """
+    Copy the directory tree `src` to the non-existing directory `dst`.
+
+    The copy is delegated to a native tool that doesn't walk the tree file by file in Python: a multithreaded `robocopy` on
+    Windows, and `cp` creating copy-on-write clones where the file system supports them on macOS and Linux.
+    We fall back to `shutil.copytree` if the tool is not available or fails.
+    Like `shutil.copytree`, symbolic links are followed and the files they point to are copied.
+    """
+    system = platform.system()
+    if system == "Windows":
+        command = ["robocopy", str(src), str(dst), "/MT:32", "/E", "/NFL", "/NDL", "/NJH", "/NJS"]
+        # Robocopy uses exit codes below 8 to report success.
+        max_success_returncode = 7
+    elif system == "Darwin":
+        command = ["cp", "-cRL", str(src), str(dst)]
+        max_success_returncode = 0
+    else:
+        # The '-L' must follow '-a', which implies not dereferencing symbolic links.
+        command = ["cp", "-a", "-L", "--reflink=auto", str(src), str(dst)]
+        max_success_returncode = 0
+
+    if shutil.which(command[0]):
+        logging.debug(f"Copying {src} to {dst} using {command[0]}.")
+        try:
+            if subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode <= max_success_returncode:
+                return
+        except OSError:
+            pass
+        logging.debug(f"Failed to copy {src} to {dst} using {command[0]}, falling back to a regular copy.")
+        shutil.rmtree(dst, ignore_errors=True)
+    threaded_copytree(src, dst)
+
+def threaded_copytree(
+    src: Path,
+    dst: Path,
+    ignore: Optional[Callable[[str, List[str]], set[str]]] = None,
+    copy_function: Callable[[str, str], Any] = shutil.copy2,
+) -> None:
+    """
+    Copy the directory tree `src` to `dst` like `shutil.copytree`, but copy the files using a pool of threads.
+
+    The directories are created up front while walking the tree, after which the files are copied concurrently.
+    Symbolic links are followed, and directory metadata is not copied.
+    """
+    files: List[tuple[str, str]] = []
+    directories = [(os.fspath(src), os.fspath(dst))]
+    while directories:
+        src_dir, dst_dir = directories.pop()
+        os.makedirs(dst_dir, exist_ok=True)
+        with os.scandir(src_dir) as it:
+            entries = list(it)
+        ignored_names = ignore(src_dir, [entry.name for entry in entries]) if ignore else set()
+        for entry in entries:
+            if entry.name in ignored_names:
+                continue
+            if entry.is_dir():
+                directories.append((entry.path, os.path.join(dst_dir, entry.name)))
+            else:
+                files.append((entry.path, os.path.join(dst_dir, entry.name)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        # Consume the results to propagate any exceptions.
+        for _ in executor.map(lambda file: copy_function(*file), files):
+            pass
+
+def merge_tree(src: Path, dst: Path) -> None:
+    """
+    Move the contents of the directory `src` into the directory `dst`, merging the directories that exist in both.
+    Both must be on the same volume.
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    for entry in src.iterdir():
+        target = dst / entry.name
+        if entry.is_dir() and target.is_dir():
+            merge_tree(entry, target)
+        else:
+            os.replace(entry, target)
+
+def open_for_rewrite(path: Path) -> IO[str]:
+    """
+    Open a file for writing, replacing the file instead of writing through a link to the original.
+
+    Prefer writing the new contents with a single `write`, e.g. by serializing YAML to a string first.
+    """
+    path.unlink(missing_ok=True)
+    return path.open("w")
+
+def is_dependencies_mapping(dependencies_block: str) -> bool:
+    """Determine if the text matched by `DEPENDENCIES_BLOCK_PATTERN` is a 'dependencies' key with a mapping value."""
+    try:
+        parsed_block = yaml.load(dependencies_block, Loader=SafeLoader)
+    except yaml.YAMLError:
+        return False
+    return isinstance(parsed_block, dict) and isinstance(parsed_block.get("dependencies"), dict)
+
+def replace_dependencies(pack: ResolvedCodeQLPack, dependencies: Dict[str, str]) -> str:
+    """
+    Return the contents of the pack's qlpack.yml with its dependencies replaced by `dependencies`.
+
+    If the qlpack.yml has a block style 'dependencies' mapping, only that mapping is replaced in the text so we don't have
+    to parse and serialize the whole file. Otherwise, e.g. when the dependencies are not an indented mapping, we fall back
+    to serializing the modified specification.
+    """
+    qlpack_yml = pack.path.read_text()
+    dependencies_blocks = list(DEPENDENCIES_BLOCK_PATTERN.finditer(qlpack_yml))
+    if len(dependencies_blocks) == 1 and is_dependencies_mapping(dependencies_blocks[0].group()):
+        dependencies_block = dependencies_blocks[0]
+        return (
+            qlpack_yml[:dependencies_block.start()]
+            + yaml.dump({"dependencies": dependencies}, Dumper=SafeDumper)
+            + qlpack_yml[dependencies_block.end():]
+        )
+    qlpack_spec = copy.deepcopy(pack.qlpack_spec)
+    qlpack_spec["dependencies"] = dependencies
+    return yaml.dump(qlpack_spec, Dumper=SafeDumper)
+
+@verify(UNIQUE)
+class BundleCompression(Enum):
+    GZIP = 1
+    ZSTD = 2
+    NONE = 3
+
+    @staticmethod
+    def from_string(compression: str) -> "BundleCompression":
+        if compression.lower() == "gzip":
+            return BundleCompression.GZIP
+        elif compression.lower() == "zstd":
+            return BundleCompression.ZSTD
+        elif compression.lower() == "none":
+            return BundleCompression.NONE
+        else:
+            raise BundleException(f"Invalid compression {compression}")
+
+    def get_extension(self) -> str:
+        if self == BundleCompression.GZIP:
+            return ".tar.gz"
+        elif self == BundleCompression.ZSTD:
+            return ".tar.zst"
+        elif self == BundleCompression.NONE:
+            return ".tar"
+        else:
+            raise BundleException(f"Invalid compression {self}")
+
+@contextmanager
+def open_bundle_archive(output_path: Path, compresslevel: int = 1, compression: BundleCompression = BundleCompression.GZIP) -> Iterator[tarfile.TarFile]:
+    """
+    Open a tar archive for writing, compressed with the specified compression.
+
+    The uncompressed tar stream is piped into an external compressor, so compression happens outside of the Python process
+    (and on multiple cores with `pigz` or `zstd`). Gzip compression uses `pigz` or `gzip` when one is available and otherwise
+    falls back to tarfile's own gzip support. Zstandard compression requires `zstd`.
+
+    The bundles are consumed by tooling rather than archived, and most of their size is in already compressed jars and
+    binaries, so we default to the fastest compression level instead of gzip's default of 9.
+    """
+    if compression == BundleCompression.NONE:
+        # Write the output through a large buffer to reduce the number of small writes.
+        with open(output_path, "wb", buffering=1 << 20) as output_file, tarfile.open(
+            fileobj=output_file, mode="w", copybufsize=TAR_COPY_BUFSIZE
+        ) as archive:
+            yield archive
+        return
+
+    if compression == BundleCompression.ZSTD:
+        compressor = shutil.which("zstd")
+        if not compressor:
+            raise BundleException(f"Cannot create {output_path}, because 'zstd' is not available!")
+        # Compress using a thread per core.
+        command = [compressor, "-q", "-c", "-T0", f"-{compresslevel}"]
+    else:
+        compressor = shutil.which("pigz") or shutil.which("gzip")
+        if not compressor:
+            # Write the compressed output through a large buffer to reduce the number of small writes.
+            with open(output_path, "wb", buffering=1 << 20) as output_file, tarfile.open(
+                fileobj=output_file, mode="w:gz", compresslevel=compresslevel, copybufsize=TAR_COPY_BUFSIZE
+            ) as archive:
+                yield archive
+            return
+
+        # Pigz compresses using a thread per core by default.
+        command = [compressor, "-c", f"-{compresslevel}"]
+    logging.debug(f"Compressing {output_path} using {' '.join(command)}.")
+    with output_path.open("wb") as output_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=output_file, bufsize=1 << 20)
+        try:
+            # Use tarfile's streaming mode because we cannot seek in a pipe.
+            with tarfile.open(fileobj=process.stdin, mode="w|", copybufsize=TAR_COPY_BUFSIZE) as archive:
+                yield archive
+        finally:
+            cast(io.BufferedWriter, process.stdin).close()
+            returncode = process.wait()
+    if returncode != 0:
+        raise BundleException(f"Failed to compress {output_path} using {compressor}!")
+
+@contextmanager
+def read_bundle_archive(bundle_path: Path) -> Iterator[tarfile.TarFile]:
+    """
+    Open a gzip compressed tar archive for streaming extraction.
+
+    The archive is decompressed by an external `pigz` or `gzip` process when one is available, so decompression happens
+    outside of the Python process, concurrently with the extraction. Otherwise we fall back to Python's gzip support.
+
+    A corrupt archive, including one that is not gzip compressed, results in a `BundleException`.
+    """
+    decompressor = shutil.which("pigz") or shutil.which("gzip")
+    if not decompressor:
+        try:
+            # Stream the archive through large read buffers to reduce the number of small reads issued while decompressing.
+            with open(bundle_path, "rb", buffering=8 << 20) as raw_file, gzip.GzipFile(
+                fileobj=raw_file
+            ) as gzip_file, io.BufferedReader(
+                gzip_file, buffer_size=4 << 20
+            ) as buffered_file, tarfile.open(fileobj=buffered_file, mode="r|", copybufsize=TAR_COPY_BUFSIZE) as archive:
+                yield archive
+        except (tarfile.ReadError, gzip.BadGzipFile, EOFError, zlib.error) as e:
+            raise BundleException(f"Failed to decompress {bundle_path}: {e}") from e
+        return
+
+    logging.debug(f"Decompressing {bundle_path} using {decompressor}.")
+    process = subprocess.Popen(
+        [decompressor, "-dc", str(bundle_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=4 << 20
+    )
+    stdout = cast(io.BufferedReader, process.stdout)
+    tar_error: Optional[tarfile.ReadError] = None
+    try:
+        try:
+            # Use tarfile's streaming mode because we cannot seek in a pipe.
+            with tarfile.open(fileobj=stdout, mode="r|", copybufsize=TAR_COPY_BUFSIZE) as archive:
+                yield archive
+        except tarfile.ReadError as e:
+            # A failing decompressor typically surfaces as a truncated or empty archive, so report it together with the
+            # decompressor's exit status and error output.
+            tar_error = e
+        # Tarfile stops reading at the end-of-archive marker, but the decompressor still writes the padding that follows
+        # it. Read the remaining output, so the decompressor doesn't fail writing to a closed pipe.
+        while stdout.read(1 << 20):
+            pass
+    finally:
+        stdout.close()
+        # The decompressor writes little error output, so it fits in the pipe until the archive has been read.
+        stderr = cast(io.BufferedReader, process.stderr).read()
+        cast(io.BufferedReader, process.stderr).close()
+        returncode = process.wait()
+    if tar_error or returncode != 0:
+        message = f"Failed to decompress {bundle_path} using {decompressor} with exit status {returncode}"
+        details = stderr.decode("utf-8", "replace").strip() or (str(tar_error) if tar_error else "")
+        raise BundleException(f"{message}: {details}" if details else message) from tar_error
+
 @verify(UNIQUE)
 class BundlePlatform(Enum):
     LINUX = 1
@@ -141,12 +555,108 @@ class BundlePlatform(Enum):
         else:
             raise BundleException(f"Invalid platform {self}")
 
+_LINUX64_SUBPATHS = (Path("linux64"), Path("linux"))
+_OSX64_SUBPATHS = (Path("osx64"), Path("macos"))
+_WIN64_SUBPATHS = (Path("win64"), Path("windows"))
+# The subpaths of a tools directory that contain the tools for other platforms than the key.
+_EXCLUDED_SUBPATHS: Dict[BundlePlatform, tuple[Path, ...]] = {
+    BundlePlatform.LINUX: _OSX64_SUBPATHS + _WIN64_SUBPATHS,
+    BundlePlatform.WINDOWS: _OSX64_SUBPATHS + _LINUX64_SUBPATHS,
+    BundlePlatform.OSX: _LINUX64_SUBPATHS + _WIN64_SUBPATHS,
+}
+
+class PlatformFilter:
+    """
+    A tarfile filter that only includes the files of a bundle for the specified platform.
+
+    The `root` is the name under which the bundle is added to the archive, i.e., the first component of every member name.
+
+    This is a module level class, instead of a closure, so it can be used in a worker process.
+    """
+    def __init__(self, platform: BundlePlatform, languages: set[str], root: str = "codeql") -> None:
+        self.platform = platform
+        self.relative_tools_paths = [Path(lang) / "tools" for lang in languages] + [Path("tools")]
+        self.exclusion_paths = self.get_exclusion_paths()
+        # Tar member names always use forward slashes, so the exclusions are matched as strings prefixed with the root.
+        self.excluded_names = frozenset(f"{root}/{path.as_posix()}" for path in self.exclusion_paths)
+        self.excluded_prefixes = tuple(f"{excluded_name}/" for excluded_name in self.excluded_names)
+
+    def get_nonplatform_tool_paths(self) -> List[Path]:
+        """Get a list of paths to tools that are not for the specified platform relative to the root of a bundle."""
+        if not self.platform in _EXCLUDED_SUBPATHS:
+            raise BundleException(f"Unsupported platform {self.platform}.")
+        excluded_subpaths = _EXCLUDED_SUBPATHS[self.platform]
+
+        return [tools_path / subpath for tools_path in self.relative_tools_paths for subpath in excluded_subpaths]
+
+    def get_exclusion_paths(self) -> List[Path]:
+        """Get a list of paths that are excluded for the specified platform relative to the root of a bundle."""
+        platform = self.platform
+        exclusion_paths = self.get_nonplatform_tool_paths()
+
+        # Manual exclusions based on diffing the contents of the platform specific bundles and the generated platform specific bundles.
+        if platform != BundlePlatform.WINDOWS:
+            exclusion_paths.append(Path("codeql.exe"))
+        else:
+            exclusion_paths.append(Path("swift/qltest"))
+            exclusion_paths.append(Path("swift/resource-dir"))
+
+        if platform == BundlePlatform.LINUX:
+            exclusion_paths.append(Path("swift/qltest/osx64"))
+            exclusion_paths.append(Path("swift/resource-dir/osx64"))
+
+        if platform == BundlePlatform.OSX:
+            exclusion_paths.append(Path("swift/qltest/linux64"))
+            exclusion_paths.append(Path("swift/resource-dir/linux64"))
+
+        return exclusion_paths
+
+    def __call__(self, tarinfo: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+        # A member is excluded if it is an excluded path or is contained in one.
+        name = tarinfo.name
+        if name in self.excluded_names or name.startswith(self.excluded_prefixes):
+            return None
+
+        return tarinfo
+
+def create_platform_bundle(
+    bundle_path: Path,
+    languages: set[str],
+    bundle_output_path: Path,
+    platform: BundlePlatform,
+    compresslevel: int = 1,
+    compression: BundleCompression = BundleCompression.GZIP,
+) -> None:
+    """
+    Create a bundle for a single platform from the bundle at `bundle_path`.
+
+    The `bundle_path` is either a bundle directory or an uncompressed archive of a bundle directory created with the
+    arcname 'codeql'. The latter allows the bundles for multiple platforms to be created without walking and reading
+    the bundle directory for each platform.
+
+    This is a module level function, so it can be run in a worker process.
+    """
+    logging.debug(f"Bundling custom bundle for {platform} to {bundle_output_path}.")
+    platform_filter = PlatformFilter(platform, languages)
+    with open_bundle_archive(bundle_output_path, compresslevel, compression) as bundle_archive:
+        if bundle_path.is_dir():
+            bundle_archive.add(bundle_path, arcname="codeql", filter=platform_filter)
+        else:
+            # Read the members in order, so the archive can be streamed through a large buffer without seeking.
+            with open(bundle_path, "rb", buffering=4 << 20) as source_file, tarfile.open(
+                fileobj=source_file, mode="r|", copybufsize=TAR_COPY_BUFSIZE
+            ) as source_archive:
+                for member in source_archive:
+                    if platform_filter(member) is None:
+                        continue
+                    bundle_archive.addfile(member, source_archive.extractfile(member) if member.isfile() else None)
+
 class Bundle:
     def __init__(self, bundle_path: Path) -> None:
         self.tmp_dir = TemporaryDirectory()
         if bundle_path.is_dir():
             self.bundle_path = Path(self.tmp_dir.name) / bundle_path.name
-            shutil.copytree(
+            fast_copytree(
                 bundle_path,
                 self.bundle_path,
             )
@@ -154,8 +664,13 @@ class Bundle:
             logging.info(
                 f"Unpacking provided bundle {bundle_path} to {self.tmp_dir.name}."
             )
-            file = tarfile.open(bundle_path)
-            file.extractall(self.tmp_dir.name)
+            # Members are extracted as they are encountered in the decompressed stream.
+            with read_bundle_archive(bundle_path) as file:
+                # Use the 'data' extraction filter when this Python version supports extraction filters.
+                if hasattr(tarfile, "data_filter"):
+                    file.extractall(self.tmp_dir.name, filter="data")
+                else:
+                    file.extractall(self.tmp_dir.name)
             self.bundle_path = Path(self.tmp_dir.name) / "codeql"
         else:
             raise BundleException("Invalid CodeQL bundle path")
@@ -203,6 +718,9 @@ class Bundle:
             resolve = build_pack_resolver(packs)
 
             self.bundle_packs: list[ResolvedCodeQLPack] = [resolve(pack) for pack in packs]
+            self.bundle_packs_by_kind: dict[CodeQLPackKind, List[ResolvedCodeQLPack]] = defaultdict(list)
+            for pack in self.bundle_packs:
+                self.bundle_packs_by_kind[pack.kind].append(pack)
 
             self.languages = self.codeql.resolve_languages()
 
@@ -234,15 +752,15 @@ class CustomBundle(Bundle):
                     f"Pack '{pack.config.name}' does not have the required scope. This pack cannot be bundled!"
                 )
 
-        resolve = build_pack_resolver(packs, self.bundle_packs)
         try:
+            resolve = build_pack_resolver(packs, self.bundle_packs)
             self.workspace_packs: list[ResolvedCodeQLPack] = [resolve(pack) for pack in packs]
         except PackResolverException as e:
             raise BundleException(e)
 
-        self.available_packs: dict[str, ResolvedCodeQLPack] = {
-            pack.config.name: pack for pack in self.bundle_packs + self.workspace_packs
-        }
+        self.available_packs: dict[str, ResolvedCodeQLPack] = {}
+        self.available_packs.update((pack.config.name, pack) for pack in self.bundle_packs)
+        self.available_packs.update((pack.config.name, pack) for pack in self.workspace_packs)
         # A custom bundle will always need a temp directory for customization work.
         # If the bundle didn't create one (there was no need to unpack it), create it here.
         if not self.tmp_dir:
@@ -272,19 +790,25 @@ class CustomBundle(Bundle):
         Languages that do not have a `Customizations.qll` module are provided with one. This process will add the `Customizations.qll` module to the standard library pack
         and import as the first module in the language module (eg., `cpp.qll` will import `Customizations.qll` as the first module).
         """
+        # The bookkeeping below is keyed by pack id, see `ResolvedCodeQLPack.pack_id`.
+        packs_by_id: dict[int, ResolvedCodeQLPack] = {
+            pack.pack_id: pack for pack in itertools.chain(self.bundle_packs, self.workspace_packs)
+        }
+        workspace_pack_ids = {pack.pack_id for pack in self.workspace_packs}
+        bundle_pack_ids = {pack.pack_id for pack in self.bundle_packs}
         # Keep a map of standard library packs to their customization packs so we know which need to be modified.
-        std_lib_deps : dict[ResolvedCodeQLPack, List[ResolvedCodeQLPack]] = defaultdict(list)
-        pack_sorter : TopologicalSorter[ResolvedCodeQLPack] = TopologicalSorter()
+        std_lib_deps : dict[int, List[ResolvedCodeQLPack]] = defaultdict(list)
+        pack_graph = PackDependencyGraph()
 
-        def add_to_graph(pack: ResolvedCodeQLPack, processed_packs: set[ResolvedCodeQLPack], std_lib_deps: dict[ResolvedCodeQLPack, List[ResolvedCodeQLPack]]):
+        def add_to_graph(pack: ResolvedCodeQLPack, processed_packs: set[int], std_lib_deps: dict[int, List[ResolvedCodeQLPack]]):
             # Only process workspace packs in this function
-            if not pack in self.workspace_packs:
+            if not pack.pack_id in workspace_pack_ids:
                 logger.debug(f"Skipping adding pack {pack.config.name}@{str(pack.config.version)} to dependency graph")
                 return
             if pack.kind == CodeQLPackKind.CUSTOMIZATION_PACK:
                 logger.debug(f"Adding customization pack {pack.config.name}@{str(pack.config.version)} to dependency graph")
-                pack_sorter.add(pack)
-                std_lib_deps[pack.dependencies[0]].append(pack)
+                pack_graph.add(pack)
+                std_lib_deps[pack.dependencies[0].pack_id].append(pack)
             else:
                 # If the query pack relies on a customization pack (e.g. for tests), add the std lib dependency of
                 # the customization pack to query pack because the customization pack will no longer have that
@@ -299,84 +823,172 @@ class CustomBundle(Bundle):
                 # We include standard library packs in the dependency graph to ensure they dictate the correct order
                 # when we need to customize packs.
                 # This does mean we will repack them, but that is only small price to pay for simplicity.
-                pack_sorter.add(pack, *pack.dependencies)
+                pack_graph.add(pack, *pack.dependencies)
                 for dep in pack.dependencies:
-                    if dep not in processed_packs:
+                    if dep.pack_id not in processed_packs:
                         add_to_graph(dep, processed_packs, std_lib_deps)
-            processed_packs.add(pack)
+            processed_packs.add(pack.pack_id)
 
-        processed_packs : set[ResolvedCodeQLPack] = set()
+        processed_packs : set[int] = set()
         for pack in packs:
-            if not pack in processed_packs:
+            if not pack.pack_id in processed_packs:
                 add_to_graph(pack, processed_packs, std_lib_deps)
 
-        def is_dependent_on(pack: ResolvedCodeQLPack, other: ResolvedCodeQLPack) -> bool:
-            return other in pack.dependencies or any(map(lambda p: is_dependent_on(p, other), pack.dependencies))
+        # Invert the dependency graph of the bundle packs once, so we can find the packs that transitively depend on a
+        # standard library pack with a single traversal.
+        bundle_dependents: dict[int, List[int]] = defaultdict(list)
+        for candidate in self.bundle_packs:
+            for dep in candidate.dependencies:
+                bundle_dependents[dep.pack_id].append(candidate.pack_id)
+
+        def get_transitive_dependents(pack_id: int) -> set[int]:
+            visited: set[int] = set()
+            worklist = deque(bundle_dependents[pack_id])
+            while worklist:
+                dependent_id = worklist.popleft()
+                if not dependent_id in visited:
+                    visited.add(dependent_id)
+                    worklist.extend(bundle_dependents[dependent_id])
+            return visited
+
+        bundle_query_pack_ids = [p.pack_id for p in self.bundle_packs_by_kind[CodeQLPackKind.QUERY_PACK]]
         # Add the stdlib and its dependencies to properly sort the customization packs before the other packs.
-        for pack, deps in std_lib_deps.items():
+        for pack_id, deps in std_lib_deps.items():
+            pack = packs_by_id[pack_id]
             logger.debug(f"Adding standard library pack {pack.config.name}@{str(pack.config.version)} to dependency graph")
-            pack_sorter.add(pack, *deps)
+            pack_graph.add(pack, *deps)
             # Add the standard query packs that rely transitively on the stdlib.
-            for query_pack in [p for p in self.bundle_packs if p.kind == CodeQLPackKind.QUERY_PACK and is_dependent_on(p, pack)]:
+            dependent_ids = get_transitive_dependents(pack_id)
+            for query_pack in [packs_by_id[p] for p in bundle_query_pack_ids if p in dependent_ids]:
                 logger.debug(f"Adding standard query pack {query_pack.config.name}@{str(query_pack.config.version)} to dependency graph")
-                pack_sorter.add(query_pack, pack)
+                pack_graph.add(query_pack, pack)
 
-        def bundle_customization_pack(customization_pack: ResolvedCodeQLPack):
+        # The bundle packs in the graph are removed from the bundle while they are processed, so a bundle pack must be
+        # processed after the packs it depends on in the graph, otherwise a dependency might be missing from the bundle.
+        for pack in list(pack_graph.packs.values()):
+            if pack.pack_id in bundle_pack_ids:
+                pack_graph.add(pack, *[dep for dep in pack.dependencies if dep in pack_graph])
+
+        def prepare_customization_pack(customization_pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
             logging.info(f"Bundling the customization pack {customization_pack.config.name}.")
-            customization_pack_copy = copy_pack(customization_pack)
+            customization_pack_copy = get_pack_copy(customization_pack)
 
             # Remove the target dependency to prevent a circular dependency in the target.
             logging.debug(
                 f"Removing dependency on standard library to prevent circular dependency."
             )
-            with customization_pack_copy.path.open("r") as fd:
-                qlpack_spec = yaml.safe_load(fd)
-
             # Assume there is only one dependency and it is the standard library.
-            qlpack_spec["dependencies"] = {}
-            with customization_pack_copy.path.open("w") as fd:
-                yaml.dump(qlpack_spec, fd)
+            qlpack_yml = replace_dependencies(customization_pack_copy, {})
+            with open_for_rewrite(customization_pack_copy.path) as fd:
+                fd.write(qlpack_yml)
+            return customization_pack_copy
 
-            logging.debug(
-                f"Bundling the customization pack {customization_pack_copy.config.name} at {customization_pack_copy.path}"
-            )
-            self.codeql.pack_bundle(
-                customization_pack_copy, self.bundle_path / "qlpacks"
-            )
-
-        def copy_pack(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
-            pack_copy_dir = (
+        def get_pack_copy_dir(pack: ResolvedCodeQLPack) -> Path:
+            return (
             Path(self.tmp_dir.name)
             / "temp" # Add a temp path segment because the standard library packs have scope 'codeql' that collides with the 'codeql' directory in the bundle that is extracted to the temporary directory.
-            / cast(str, pack.config.get_scope())
-            / pack.config.get_pack_name()
+            / cast(str, pack.scope)
+            / pack.pack_name
             / str(pack.config.version)
             )
 
+        def is_moved(pack: ResolvedCodeQLPack) -> bool:
+            # Standard packs in the bundle are removed before their modified copy is added, so they are moved instead of
+            # copied.
+            return pack.scope == "codeql" and pack.pack_id in bundle_pack_ids
+
+        def move_pack(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
+            """
+            Move a standard pack out of the bundle for modification. Both live in our temporary directory, so this is a
+            cheap rename. The pack is no longer available in the bundle afterwards, so only move it right before it is
+            processed.
+            """
+            pack_copy_dir = get_pack_copy_dir(pack)
             logging.debug(
-                f"Copying {pack.path.parent} to {pack_copy_dir} for modification"
-            )
-            shutil.copytree(
-                pack.path.parent,
-                pack_copy_dir,
+                f"Moving {pack.path.parent} to {pack_copy_dir} for modification"
             )
+            pack_copy_dir.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(pack.path.parent, pack_copy_dir)
+            return dataclasses.replace(pack, path=pack_copy_dir / pack.path.name)
+
+        def get_pack_copy(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
+            """Return the modifiable copy of the pack, moving the pack out of the bundle if it is a standard pack."""
+            if is_moved(pack):
+                return move_pack(pack)
+            return pack_copies[pack.pack_id]
+
+        def copy_pack(pack: ResolvedCodeQLPack, ignore: Optional[Callable[[str, List[str]], set[str]]] = None) -> ResolvedCodeQLPack:
+            """
+            Create a modifiable copy of the pack. The `ignore` callable has the same semantics as the one accepted by
+            `shutil.copytree`.
+            """
+            pack_copy_dir = get_pack_copy_dir(pack)
+
+            # Only a few files are modified, so hard link to the original files instead of copying the whole pack. Unlike
+            # symbolic links, hard links are regular files, so neither the CodeQL CLI nor the bundle ends up with links
+            # to the original pack. Hard links can only be created on the same volume, so fall back to copying otherwise.
+            pack_copy_dir.parent.mkdir(parents=True, exist_ok=True)
+            if os.stat(pack.path.parent).st_dev == os.stat(pack_copy_dir.parent).st_dev:
+                logging.debug(
+                    f"Hard linking {pack.path.parent} to {pack_copy_dir} for modification"
+                )
+                # The CodeQL CLI runs on the copy and may update the lock file and the dependencies and cache directories
+                # in place, so copy those to leave the original pack untouched.
+                pack_dir = os.fspath(pack.path.parent)
+                cli_writable_file = os.path.join(pack_dir, "codeql-pack.lock.yml")
+                cli_writable_prefixes = tuple(os.path.join(pack_dir, name) + os.sep for name in (".codeql", ".cache"))
+
+                def link_or_copy_unless_cli_writable(src: str, dst: str) -> None:
+                    if src == cli_writable_file or src.startswith(cli_writable_prefixes):
+                        shutil.copy(src, dst)
+                    else:
+                        link_or_copy(src, dst)
+
+                shutil.copytree(
+                    pack.path.parent,
+                    pack_copy_dir,
+                    copy_function=link_or_copy_unless_cli_writable,
+                    ignore=ignore,
+                )
+            else:
+                logging.debug(
+                    f"Copying {pack.path.parent} to {pack_copy_dir} for modification"
+                )
+                if ignore:
+                    threaded_copytree(
+                        pack.path.parent,
+                        pack_copy_dir,
+                        ignore=ignore,
+                        # The copies are only used as input for the CodeQL CLI, so there is no need to preserve file metadata.
+                        copy_function=shutil.copy,
+                    )
+                else:
+                    # The native copy tools (which create copy-on-write clones where supported) don't support ignoring
+                    # files, so only use them when nothing is ignored.
+                    fast_copytree(pack.path.parent, pack_copy_dir)
             pack_copy_path = (
                 pack_copy_dir / pack.path.name
             )
             return dataclasses.replace(pack, path=pack_copy_path)
 
-        def add_customization_support(pack: ResolvedCodeQLPack):
+        def add_customization_support(pack: ResolvedCodeQLPack) -> str:
+            """
+            Ensure the standard library pack can import a 'Customizations' library and return the contents of that library.
+            The caller is responsible for writing the (extended) contents to the pack's 'Customizations.qll'.
+            """
             if pack.is_customizable():
-                return
+                return pack.get_customizations_module_path().read_text()
 
-            if not pack.config.get_scope() == "codeql" or not pack.config.library:
-                return
+            if not pack.scope == "codeql" or not pack.config.library:
+                raise BundleException(
+                    f"Unable to customize {pack.config.name}, because it is not a standard library pack."
+                )
 
             logging.debug(
                     f"Standard library CodeQL pack {pack.config.name} does not have a 'Customizations' library, attempting to add one."
                 )
             # Assume the CodeQL library pack has name `<language>-all`.
-            target_language = pack.config.get_pack_name().removesuffix("-all")
+            target_language = pack.pack_name.removesuffix("-all")
             target_language_library_path = (
                 pack.path.parent / f"{target_language}.qll"
             )
@@ -390,168 +1002,219 @@ class CustomBundle(Bundle):
             logging.debug(
                 f"Found standard library language module {target_language_library_path.name}, adding import of 'Customizations' library."
             )
-            with target_language_library_path.open("r") as fd:
-                target_language_library_lines = fd.readlines()
+            target_language_library = target_language_library_path.read_text()
             logging.debug(f"Looking for the first import statement.")
 
-            first_import_idx = None
-            for idx, line in enumerate(target_language_library_lines):
-                if line.startswith("import"):
-                    first_import_idx = idx
-                    break
-            if first_import_idx == None:
+            first_import = re.search(r"^import", target_language_library, flags=re.MULTILINE)
+            if first_import == None:
                 raise BundleException(
                     f"Unable to customize {pack.config.name}, because we cannot determine the first import statement of {target_language_library_path.name}."
                 )
             logging.debug(
                 "Found first import statement and prepending import statement importing 'Customizations'"
             )
-            target_language_library_lines.insert(
-                first_import_idx, "import Customizations\n"
-            )
-            with target_language_library_path.open("w") as fd:
-                fd.writelines(target_language_library_lines)
+            first_import_idx = first_import.start()
+            with open_for_rewrite(target_language_library_path) as fd:
+                fd.write(
+                    target_language_library[:first_import_idx]
+                    + "import Customizations\n"
+                    + target_language_library[first_import_idx:]
+                )
             logging.debug(
                 f"Writing modified language library to {target_language_library_path}"
             )
 
-            target_customization_library_path = (
-                pack.path.parent / "Customizations.qll"
-            )
             logging.debug(
                 f"Creating Customizations library with import of language {target_language}"
             )
-            with target_customization_library_path.open("w") as fd:
-                fd.write(f"import {target_language}\n")
+            return f"import {target_language}\n"
 
-        def bundle_stdlib_pack(pack: ResolvedCodeQLPack):
+        def prepare_stdlib_pack(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
             logging.info(f"Bundling the standard library pack {pack.config.name}.")
 
-            pack_copy = copy_pack(pack)
+            pack_copy = get_pack_copy(pack)
 
-            with pack_copy.path.open("r") as fd:
-                qlpack_spec = yaml.safe_load(fd)
+            qlpack_spec = copy.deepcopy(pack_copy.qlpack_spec)
             if not "dependencies" in qlpack_spec:
                 qlpack_spec["dependencies"] = {}
-            for customization_pack in std_lib_deps[pack]:
+            for customization_pack in std_lib_deps[pack.pack_id]:
                 logging.debug(
                     f"Adding dependency {customization_pack.config.name} to {pack_copy.config.name}"
                 )
                 qlpack_spec["dependencies"][customization_pack.config.name] = str(
                     customization_pack.config.version
                 )
-            with pack_copy.path.open("w") as fd:
-                yaml.dump(qlpack_spec, fd)
+            with open_for_rewrite(pack_copy.path) as fd:
+                fd.write(yaml.dump(qlpack_spec, Dumper=SafeDumper))
 
             logging.debug(
                 f"Determining if standard library CodeQL library pack {pack_copy.config.name} is customizable."
             )
-            if not pack_copy.is_customizable():
-                add_customization_support(pack_copy)
+            # Adds a 'Customizations' library if the pack doesn't already provide one.
+            contents = add_customization_support(pack_copy)
 
             logging.debug(
                 f"Updating 'Customizations.qll' with imports of customization libraries."
             )
-            with pack_copy.get_customizations_module_path().open("r") as fd:
-                contents = fd.readlines()
-            for customization_pack in std_lib_deps[pack]:
-                contents.append(
-                    f"import {customization_pack.get_module_name()}.Customizations"
-                )
-            with pack_copy.get_customizations_module_path().open("w") as fd:
-                fd.writelines(contents)
+            if contents and not contents.endswith("\n"):
+                contents += "\n"
+            contents += "".join(
+                f"import {customization_pack.get_module_name()}.Customizations\n"
+                for customization_pack in std_lib_deps[pack.pack_id]
+            )
+            with open_for_rewrite(pack_copy.get_customizations_module_path()) as fd:
+                fd.write(contents)
 
             # Remove the original target library pack
             logging.debug(
                 f"Removing the standard library at {pack.path} in preparation for replacement."
             )
             shutil.rmtree(pack.path.parent.parent)
-            # Bundle the new into the bundle.
-            logging.debug(
-                f"Bundling the standard library pack {pack_copy.config.name} at {pack_copy.path}"
-            )
-            self.codeql.pack_bundle(pack_copy, self.bundle_path / "qlpacks")
+            return pack_copy
 
-        def bundle_library_pack(library_pack: ResolvedCodeQLPack):
+        def prepare_library_pack(library_pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
             logging.info(f"Bundling the library pack {library_pack.config.name}.")
-            self.codeql.pack_bundle(
-                library_pack,
-                self.bundle_path / "qlpacks",
-            )
+            return library_pack
 
-        def bundle_query_pack(pack: ResolvedCodeQLPack):
-            if pack.config.get_scope() == "codeql":
+        def prepare_query_pack(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
+            if pack.scope == "codeql":
                 logging.info(f"Bundling the standard query pack {pack.config.name}.")
-                pack_copy = copy_pack(pack)
-
-                # Remove the lock file
-                logging.debug(
-                    f"Removing CodeQL pack lock file {pack_copy.get_lock_file_path()}"
-                )
-                pack_copy.get_lock_file_path().unlink()
-                # Remove the included dependencies
-                logging.debug(
-                    f"Removing CodeQL query pack dependencies directory {pack_copy.get_dependencies_path()}"
-                )
-                shutil.rmtree(pack_copy.get_dependencies_path())
-                # Remove the query cache, if it exists.
-                logging.debug(
-                    f"Removing CodeQL query pack cache directory {pack_copy.get_cache_path()}, if it exists."
-                )
-                shutil.rmtree(
-                    pack_copy.get_cache_path(),
-                    ignore_errors=True,
-                )
-                # Remove qlx files
-                if self.codeql.supports_qlx():
-                    logging.debug(f"Removing 'qlx' files in {pack_copy.path.parent}.")
-                    for qlx_path in pack_copy.path.parent.glob("**/*.qlx"):
-                        qlx_path.unlink()
+                pack_copy = get_pack_copy(pack)
+
+                # The files regenerated by 'codeql pack create' are skipped when the pack is copied, but a pack moved out
+                # of the bundle still contains them.
+                if is_moved(pack):
+                    # Remove the lock file
+                    logging.debug(
+                        f"Removing CodeQL pack lock file {pack_copy.get_lock_file_path()}, if it exists."
+                    )
+                    pack_copy.get_lock_file_path().unlink(missing_ok=True)
+                    # Remove the included dependencies
+                    logging.debug(
+                        f"Removing CodeQL query pack dependencies directory {pack_copy.get_dependencies_path()}, if it exists."
+                    )
+                    shutil.rmtree(pack_copy.get_dependencies_path(), ignore_errors=True)
+                    # Remove the query cache, if it exists.
+                    logging.debug(
+                        f"Removing CodeQL query pack cache directory {pack_copy.get_cache_path()}, if it exists."
+                    )
+                    shutil.rmtree(
+                        pack_copy.get_cache_path(),
+                        ignore_errors=True,
+                    )
+                    # Remove qlx files
+                    if self.codeql.supports_qlx():
+                        logging.debug(f"Removing 'qlx' files in {pack_copy.path.parent}.")
+                        for dirpath, _, filenames in os.walk(pack_copy.path.parent):
+                            for filename in filenames:
+                                if filename.endswith(".qlx"):
+                                    os.unlink(os.path.join(dirpath, filename))
 
                 # Remove the original query pack
                 logging.debug(
                     f"Removing the standard library query pack directory {pack.path.parent.parent} in preparation for recreation."
                 )
                 shutil.rmtree(pack.path.parent.parent)
-                logging.debug(
-                    f"Recreating {pack_copy.config.name} at {pack_copy.path} to {self.bundle_path / 'qlpacks'}"
-                )
-                # Recompile the query pack with the assumption that all its dependencies are now in the bundle.
-                self.codeql.pack_create(
-                    pack_copy,
-                    self.bundle_path / "qlpacks",
-                    self.bundle_path,
-                )
             else:
                 logging.info(f"Bundling the query pack {pack.config.name}.")
-                pack_copy = copy_pack(pack)
+                pack_copy = get_pack_copy(pack)
                 # Rewrite the query pack dependencies
-                with pack_copy.path.open("r") as fd:
-                    qlpack_spec = yaml.safe_load(fd)
-
                 # Assume there is only one dependency and it is the standard library.
-                qlpack_spec["dependencies"] = {pack.config.name: str(pack.config.version) for pack in pack_copy.dependencies}
+                qlpack_yml = replace_dependencies(
+                    pack_copy, {pack.config.name: str(pack.config.version) for pack in pack_copy.dependencies}
+                )
                 logging.debug(f"Rewriting dependencies for {pack.config.name}.")
-                with pack_copy.path.open("w") as fd:
-                    yaml.dump(qlpack_spec, fd)
+                with open_for_rewrite(pack_copy.path) as fd:
+                    fd.write(qlpack_yml)
+            return pack_copy
 
-                self.codeql.pack_create(
-                    pack_copy,
-                    self.bundle_path / "qlpacks",
+        pack_levels = pack_graph.static_order()
+        sorted_packs = [pack for level in pack_levels for pack in level]
+        logger.debug(f"Sorted packs: {' -> '.join(map(lambda p: p.config.name, sorted_packs))}")
+        # All packs, except for non-standard library packs, are modified before bundling so we need a copy of them.
+        # 'codeql pack bundle' doesn't modify its input, so the other packs are bundled straight from their source.
+        # The copies are independent and copying is I/O bound, so create them up front in parallel. Standard packs in the
+        # bundle are moved instead, right before they are processed, because the packs processed before them might
+        # depend on them.
+        def needs_copy(pack: ResolvedCodeQLPack) -> bool:
+            if is_moved(pack):
+                return False
+            if pack.kind == CodeQLPackKind.LIBRARY_PACK:
+                return pack.scope == "codeql"
+            return True
+
+        packs_to_copy = [pack for pack in sorted_packs if needs_copy(pack)]
+        supports_qlx = self.codeql.supports_qlx()
+
+        def get_copy_ignore(pack: ResolvedCodeQLPack) -> Optional[Callable[[str, List[str]], set[str]]]:
+            """
+            Standard query packs are recreated, so skip the files that are regenerated by 'codeql pack create' instead of
+            copying them only to remove them. The lock file and the dependencies and cache directories are only skipped
+            at the root of the pack, the 'qlx' files are skipped anywhere in the pack.
+            """
+            if pack.kind != CodeQLPackKind.QUERY_PACK or pack.scope != "codeql":
+                return None
+            pack_dir = os.fspath(pack.path.parent)
+
+            def ignore(directory: str, names: List[str]) -> set[str]:
+                ignored_names = {name for name in names if name.endswith(".qlx")} if supports_qlx else set()
+                if directory == pack_dir:
+                    ignored_names.update(name for name in names if name in (".codeql", ".cache", "codeql-pack.lock.yml"))
+                return ignored_names
+            return ignore
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            pack_copies: dict[int, ResolvedCodeQLPack] = dict(
+                zip(
+                    (pack.pack_id for pack in packs_to_copy),
+                    executor.map(copy_pack, packs_to_copy, map(get_copy_ignore, packs_to_copy)),
                 )
+            )
 
-        sorted_packs = list(pack_sorter.static_order())
-        logger.debug(f"Sorted packs: {' -> '.join(map(lambda p: p.config.name, sorted_packs))}")
-        for pack in sorted_packs:
+        def prepare_pack(pack: ResolvedCodeQLPack) -> ResolvedCodeQLPack:
+            """
+            Make the modifications needed to bundle the pack, including removing the pack from the bundle if it is
+            replaced, and return the pack to pass to the CodeQL CLI.
+            """
             if pack.kind == CodeQLPackKind.CUSTOMIZATION_PACK:
-                bundle_customization_pack(pack)
+                return prepare_customization_pack(pack)
             elif pack.kind == CodeQLPackKind.LIBRARY_PACK:
-                if pack.config.get_scope() == "codeql":
-                    bundle_stdlib_pack(pack)
+                if pack.scope == "codeql":
+                    return prepare_stdlib_pack(pack)
                 else:
-                    bundle_library_pack(pack)
-            elif pack.kind == CodeQLPackKind.QUERY_PACK:
-                bundle_query_pack(pack)
+                    return prepare_library_pack(pack)
+            else:
+                return prepare_query_pack(pack)
+
+        def bundle_pack(pack: ResolvedCodeQLPack, pack_copy: ResolvedCodeQLPack, output_path: Path):
+            logging.debug(
+                f"Bundling {pack_copy.config.name} at {pack_copy.path} to {output_path}"
+            )
+            output_path.mkdir(parents=True)
+            if pack.kind != CodeQLPackKind.QUERY_PACK:
+                self.codeql.pack_bundle(pack_copy, output_path)
+            elif pack.scope == "codeql":
+                # Recompile the query pack with the assumption that all its dependencies are now in the bundle.
+                self.codeql.pack_create(pack_copy, output_path, self.bundle_path)
+            else:
+                self.codeql.pack_create(pack_copy, output_path)
+
+        # The packs in a level don't depend on each other, so the CodeQL CLI invocations for a level can run concurrently.
+        # A level must be completed before the next level is started, because its packs must be in the bundle first.
+        # The CLI scans the bundle for the dependencies of a pack, so the bundle must not change while the invocations
+        # run. Therefore, the packs in a level are prepared (and replaced packs removed from the bundle) up front, and
+        # each invocation writes its pack to a separate staging directory that is moved into the bundle afterwards.
+        staging_path = Path(self.tmp_dir.name) / "staging"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CODEQL_INVOCATIONS, os.cpu_count() or 1)) as executor:
+            for level in pack_levels:
+                level_pack_copies = [prepare_pack(pack) for pack in level]
+                output_paths = [staging_path / str(pack.pack_id) for pack in level]
+                # Consume the results to propagate any exceptions.
+                for _ in executor.map(bundle_pack, level, level_pack_copies, output_paths):
+                    pass
+                for output_path in output_paths:
+                    merge_tree(output_path, self.bundle_path / "qlpacks")
+                    shutil.rmtree(output_path)
 
     def add_code_scanning_config(self, default_config: Path):
         if not default_config.exists():
@@ -560,13 +1223,28 @@ class CustomBundle(Bundle):
             raise BundleException(f"Default config {default_config} is not a file.")
         shutil.copy(default_config, self.bundle_path / "default-codeql-config.yml")
 
-    def bundle(self, output_path: Path, platforms: set[BundlePlatform] = set(), default_config : Optional[Path] = None):
+    def bundle(
+        self,
+        output_path: Path,
+        platforms: set[BundlePlatform] = set(),
+        default_config : Optional[Path] = None,
+        compresslevel: int = 1,
+        compression: BundleCompression = BundleCompression.GZIP,
+    ):
+        """
+        Create the custom bundle(s) at the output path.
+
+        The `compression` determines how the bundle archives are compressed, and the extension of the bundles created in
+        an output directory. The `compresslevel` is the compression level used for the bundle archives. It defaults to the
+        fastest level, because bundles mostly contain already compressed jars and binaries, so higher levels (e.g., 6 or 9)
+        cost a lot more CPU time for a marginally smaller archive.
+        """
         if len(platforms) == 0:
             if output_path.is_dir():
-                output_path = output_path / "codeql-bundle.tar.gz"
+                output_path = output_path / f"codeql-bundle{compression.get_extension()}"
 
             logging.debug(f"Bundling custom bundle to {output_path}.")
-            with tarfile.open(output_path, mode="w:gz") as bundle_archive:
+            with open_bundle_archive(output_path, compresslevel, compression) as bundle_archive:
                 bundle_archive.add(self.bundle_path, arcname="codeql")
         else:
             if not output_path.is_dir():
@@ -580,73 +1258,38 @@ class CustomBundle(Bundle):
                     f"Unsupported platform(s) {', '.join(map(str,unsupported_platforms))} specified. Use the platform agnostic bundle to bundle for different platforms."
                 )
 
-            def create_bundle_for_platform(bundle_output_path:Path, platform: BundlePlatform) -> None:
-                """Create a bundle for a single platform."""
-                def filter_for_platform(platform: BundlePlatform) -> Callable[[tarfile.TarInfo], Optional[tarfile.TarInfo]]:
-                    """Create a filter function that will only include files for the specified platform."""
-                    relative_tools_paths = [Path(lang) / "tools" for lang in self.languages] + [Path("tools")]
-
-                    def get_nonplatform_tool_paths(platform: BundlePlatform) -> List[Path]:
-                        """Get a list of paths to tools that are not for the specified platform relative to the root of a bundle."""
-                        specialize_path : Optional[Callable[[Path], List[Path]]] = None
-                        linux64_subpaths = [Path("linux64"), Path("linux")]
-                        osx64_subpaths = [Path("osx64"), Path("macos")]
-                        win64_subpaths = [Path("win64"), Path("windows")]
-                        if platform == BundlePlatform.LINUX:
-                            specialize_path = lambda p: [p / subpath for subpath in osx64_subpaths + win64_subpaths]
-                        elif platform == BundlePlatform.WINDOWS:
-                            specialize_path = lambda p: [p / subpath for subpath in osx64_subpaths + linux64_subpaths]
-                        elif platform == BundlePlatform.OSX:
-                            specialize_path = lambda p: [p / subpath for subpath in linux64_subpaths + win64_subpaths]
-                        else:
-                            raise BundleException(f"Unsupported platform {platform}.")
-
-                        return [candidate for candidates in map(specialize_path, relative_tools_paths) for candidate in candidates]
-
-                    def filter(tarinfo: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
-                        tarfile_path = Path(tarinfo.name)
-
-                        exclusion_paths = get_nonplatform_tool_paths(platform)
-                        
-                        # Manual exclusions based on diffing the contents of the platform specific bundles and the generated platform specific bundles.
-                        if platform != BundlePlatform.WINDOWS:
-                            exclusion_paths.append(Path("codeql.exe"))
-                        else:
-                            exclusion_paths.append(Path("swift/qltest"))
-                            exclusion_paths.append(Path("swift/resource-dir"))
-
-                        if platform == BundlePlatform.LINUX:
-                            exclusion_paths.append(Path("swift/qltest/osx64"))
-                            exclusion_paths.append(Path("swift/resource-dir/osx64"))
-
-                        if platform == BundlePlatform.OSX:
-                            exclusion_paths.append(Path("swift/qltest/linux64"))
-                            exclusion_paths.append(Path("swift/resource-dir/linux64"))
-                        
-                        
-                        tarfile_path_root = Path(tarfile_path.parts[0])
-                        exclusion_paths = [tarfile_path_root / path for path in exclusion_paths]
-
-                        if any(tarfile_path.is_relative_to(path) for path in exclusion_paths):
-                            return None
-
-                        return tarinfo
-
-                    return filter
-                logging.debug(f"Bundling custom bundle for {platform} to {bundle_output_path}.")
-                with tarfile.open(bundle_output_path, mode="w:gz") as bundle_archive:
-                    bundle_archive.add(
-                        self.bundle_path, arcname="codeql", filter=filter_for_platform(platform)
-                    )
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=len(platforms)) as executor:
-                future_to_platform = {executor.submit(create_bundle_for_platform, output_path / f"codeql-bundle-{platform}.tar.gz", platform): platform for platform in platforms}
-                for future in concurrent.futures.as_completed(future_to_platform):
-                    platform = future_to_platform[future]
-                    try:
-                        future.result()
-                    except Exception as exc:
-                        raise BundleException(f"Failed to create bundle for platform {platform} with exception: {exc}.")
+            # Keep the intermediate archive in our working area instead of the system's, often small, temporary directory.
+            with TemporaryDirectory(dir=self.tmp_dir.name) as archive_dir:
+                # The platform specific bundles share most of their files, so walk and read the bundle directory once into an
+                # uncompressed archive that is filtered for each platform.
+                if len(platforms) > 1:
+                    source_path = Path(archive_dir) / "codeql-bundle.tar"
+                    logging.debug(f"Archiving custom bundle to {source_path}.")
+                    with open_bundle_archive(source_path, compression=BundleCompression.NONE) as source_archive:
+                        source_archive.add(self.bundle_path, arcname="codeql")
+                else:
+                    source_path = self.bundle_path
+
+                # Creating an archive is largely CPU bound Python code, so use processes to create the bundles in parallel.
+                with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(platforms), os.cpu_count() or 1)) as executor:
+                    future_to_platform = {
+                        executor.submit(
+                            create_platform_bundle,
+                            source_path,
+                            self.languages,
+                            output_path / f"codeql-bundle-{platform}{compression.get_extension()}",
+                            platform,
+                            compresslevel,
+                            compression,
+                        ): platform
+                        for platform in platforms
+                    }
+                    for future in concurrent.futures.as_completed(future_to_platform):
+                        platform = future_to_platform[future]
+                        try:
+                            future.result()
+                        except Exception as exc:
+                            raise BundleException(f"Failed to create bundle for platform {platform} with exception: {exc}.")
 
 
 
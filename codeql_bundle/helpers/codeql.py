@@ -1,18 +1,33 @@
 import subprocess
-import json
+try:
+    # Prefer the faster JSON parser implemented as a native extension when it is installed.
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 from semantic_version import Version, NpmSpec
 from pathlib import Path
 from typing import Dict, Any, Iterable, Self, Optional, List
 import yaml
 from dataclasses import dataclass, fields, field
 import logging
+import functools
+import os
 
 logger = logging.getLogger(__name__)
 
+# Prefer the libyaml backed implementations when PyYAML is built with libyaml support.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 class CodeQLException(Exception):
     pass
 
+# Packs in a workspace or bundle share a small set of versions and version constraints (e.g., on the standard library),
+# so parse each distinct string once. The parsed values are immutable, so they can be shared between packs.
+_parse_version = functools.lru_cache(maxsize=None)(Version)
+_parse_spec = functools.lru_cache(maxsize=None)(NpmSpec)
+
 
 @dataclass(kw_only=True, frozen=True, eq=True)
 class CodeQLPackConfig:
@@ -28,9 +43,9 @@ class CodeQLPackConfig:
 
         def _convert_value(k : str, v : Any) -> Any:
             if k == "version":
-                return Version(v)
+                return _parse_version(v)
             elif k == "dependencies":
-                return {k: NpmSpec(v) for k, v in v.items()}
+                return {k: _parse_spec(v) for k, v in v.items()}
             else:
                 return v
 
@@ -60,40 +75,46 @@ class CodeQLPack:
     def __hash__(self) -> int:
         return hash(f"{self.path}")
 
+@functools.lru_cache(maxsize=None)
+def _load_qlpack_config(qlpack_yml_path: str, mtime_ns: int) -> CodeQLPackConfig:
+    # The modification time is part of the cache key so a changed qlpack.yml is parsed again.
+    with open(qlpack_yml_path, "r") as qlpack_yml_file:
+        qlpack_yml_as_dict: Dict[str, Any] = yaml.load(qlpack_yml_file, Loader=SafeLoader)
+        return CodeQLPackConfig.from_dict(qlpack_yml_as_dict)
+
 class CodeQL:
     def __init__(self, codeql_path: Path):
         self.codeql_path = codeql_path
-        self._version = None
+        self._version_info: Optional[Dict[str, Any]] = None
+        self._version: Optional[Version] = None
 
-    def _exec(self, command: str, *args: str) -> subprocess.CompletedProcess[str]:
+    def _exec(self, command: str, *args: str) -> subprocess.CompletedProcess[bytes]:
         logger.debug(
             f"Running CodeQL command: {command} with arguments: {' '.join(args)}"
         )
+        # The output is kept as bytes, because json_loads accepts bytes directly and stderr is only needed on failure.
         return subprocess.run(
             [f"{self.codeql_path}", command] + [arg for arg in args],
             capture_output=True,
-            text=True
         )
 
-    def version(self) -> Version:
-        if self._version != None:
-            return self._version
-        else:
+    def _get_version_info(self) -> Dict[str, Any]:
+        # The version information doesn't change, so only ask the CLI once.
+        if self._version_info == None:
             cp = self._exec("version", "--format=json")
             if cp.returncode == 0:
-                version_info = json.loads(cp.stdout)
-                self._version = Version(version_info["version"])
-                return self._version
+                self._version_info = json_loads(cp.stdout)
             else:
                 raise CodeQLException(f"Failed to run {cp.args} command!")
+        return self._version_info
+
+    def version(self) -> Version:
+        if self._version == None:
+            self._version = Version(self._get_version_info()["version"])
+        return self._version
 
     def unpacked_location(self) -> Path:
-        cp = self._exec("version", "--format=json")
-        if cp.returncode == 0:
-            version_info = json.loads(cp.stdout)
-            return Path(version_info["unpackedLocation"])
-        else:
-            raise CodeQLException(f"Failed to run {cp.args} command!")
+        return Path(self._get_version_info()["unpackedLocation"])
 
     def supports_qlx(self) -> bool:
         return self.version() >= Version("2.11.4")
@@ -101,23 +122,21 @@ class CodeQL:
     def pack_ls(self, workspace: Path = Path.cwd()) -> List[CodeQLPack]:
         cp = self._exec("pack", "ls", "--format=json", str(workspace))
         if cp.returncode == 0:
-            packs: Iterable[Path] = map(Path, json.loads(cp.stdout)["packs"].keys())
+            packs: Iterable[Path] = map(Path, json_loads(cp.stdout)["packs"].keys())
 
             def load(qlpack_yml_path: Path) -> CodeQLPack:
-                with qlpack_yml_path.open("r") as qlpack_yml_file:
-                    logger.debug(f"Loading CodeQL pack configuration at {qlpack_yml_path}.")
-                    qlpack_yml_as_dict: Dict[str, Any] = yaml.safe_load(qlpack_yml_file)
-                    qlpack_config = CodeQLPackConfig.from_dict(qlpack_yml_as_dict)
-                    qlpack = CodeQLPack(path=qlpack_yml_path, config=qlpack_config)
-                    logger.debug(
-                        f"Loaded {qlpack.config.name} with version {str(qlpack.config.version)} at {qlpack.path}."
-                    )
-                    return qlpack
+                logger.debug(f"Loading CodeQL pack configuration at {qlpack_yml_path}.")
+                qlpack_config = _load_qlpack_config(str(qlpack_yml_path), os.stat(qlpack_yml_path).st_mtime_ns)
+                qlpack = CodeQLPack(path=qlpack_yml_path, config=qlpack_config)
+                logger.debug(
+                    f"Loaded {qlpack.config.name} with version {str(qlpack.config.version)} at {qlpack.path}."
+                )
+                return qlpack
 
             logger.debug(f"Listing CodeQL packs for workspace {workspace}")
             return list(map(load, packs))
         else:
-            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr}")
+            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr.decode('utf-8', 'replace')}")
 
     def pack_bundle(
         self,
@@ -139,7 +158,7 @@ class CodeQL:
         )
 
         if cp.returncode != 0:
-            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr}")
+            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr.decode('utf-8', 'replace')}")
 
     def pack_create(
         self,
@@ -163,11 +182,11 @@ class CodeQL:
         )
 
         if cp.returncode != 0:
-            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr}")
+            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr.decode('utf-8', 'replace')}")
         
     def resolve_languages(self) -> set[str]:
         cp = self._exec("resolve", "languages", "--format=json")
         if cp.returncode == 0:
-            return set(json.loads(cp.stdout).keys())
+            return set(json_loads(cp.stdout).keys())
         else:
-            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr}")
+            raise CodeQLException(f"Failed to run {cp.args} command! {cp.stderr.decode('utf-8', 'replace')}")
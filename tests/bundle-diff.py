@@ -1,12 +1,32 @@
+import os
 from pathlib import Path
 
+def collect(root: Path) -> set[str]:
+    """Collect the paths of all the files and directories in root, relative to root."""
+    paths : set[str] = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative_dirpath = os.path.relpath(dirpath, root)
+        for name in dirnames + filenames:
+            paths.add(os.path.normpath(os.path.join(relative_dirpath, name)))
+    return paths
+
+def collapse(paths: set[str]) -> set[str]:
+    """Remove the paths that are contained in another path in the set, so only the top-most paths remain."""
+    # Sorting on the path components places the paths contained in a path directly after it, so we only have to compare
+    # each path with the last path we kept.
+    collapsed : set[str] = set()
+    last_prefix = None
+    for path in sorted(paths, key=lambda path: path.split(os.sep)):
+        if last_prefix and path.startswith(last_prefix):
+            continue
+        collapsed.add(path)
+        last_prefix = path + os.sep
+    return collapsed
+
 def main(argv : list[str]) -> int:
     if len(argv[1:]) != 2:
         print("Usage: bundle-diff.py <bundle1> <bundle2>")
         return 1
-    
-    added : set[Path] = set()
-    removed : set[Path] = set()
 
     bundle1 = Path(argv[1])
     if not bundle1.is_dir():
@@ -16,35 +36,23 @@ def main(argv : list[str]) -> int:
     if not bundle2.is_dir():
         print(f"Error: {bundle2} is not a directory")
         return 1
-    
+
     bundle1 = bundle1.absolute()
     bundle2 = bundle2.absolute()
-    
-    for p in bundle1.glob("**/*"):
-        subpath = p.absolute().relative_to(bundle1)
-        #print(subpath)
-        if not set(subpath.parents).isdisjoint(removed):
-            continue
-        path_in_bundle2 = bundle2 / subpath
-        #print(path_in_bundle2)
-        if not path_in_bundle2.exists():
-            removed.add(subpath)
-
-    for p in bundle2.glob("**/*"):
-        subpath = p.absolute().relative_to(bundle2)
-        if not set(subpath.parents).isdisjoint(added):
-            continue
-        path_in_bundle1 = bundle1 / subpath
-        if not path_in_bundle1.exists():
-            added.add(subpath)
-    
-    for p in sorted(added):
+
+    # Walk each bundle once and compare the results, instead of checking for the existence of each path in the other bundle.
+    bundle1_paths = collect(bundle1)
+    bundle2_paths = collect(bundle2)
+    added = collapse(bundle2_paths - bundle1_paths)
+    removed = collapse(bundle1_paths - bundle2_paths)
+
+    for p in sorted(map(Path, added)):
         print(f"+ {p}")
 
-    for p in sorted(removed):
+    for p in sorted(map(Path, removed)):
         print(f"- {p}")
     return 0
 
 if __name__ == "__main__":
     import sys
-    sys.exit(main(sys.argv))
\ No newline at end of file
+    sys.exit(main(sys.argv))
@@ -0,0 +1,344 @@
+import gzip
+import io
+import os
+import tarfile
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+from unittest import mock
+
+from semantic_version import NpmSpec, Version
+
+from codeql_bundle.helpers.codeql import CodeQLPack, CodeQLPackConfig
+from codeql_bundle.helpers.bundle import (
+    BundleCompression,
+    BundleException,
+    BundlePlatform,
+    CodeQLPackKind,
+    PackDependencyGraph,
+    PackResolverException,
+    ResolvedCodeQLPack,
+    build_pack_resolver,
+    create_platform_bundle,
+    open_bundle_archive,
+    read_bundle_archive,
+    replace_dependencies,
+)
+
+
+def create_pack(name: str, version: str = "0.0.1", dependencies: Dict[str, str] = {}) -> CodeQLPack:
+    config = CodeQLPackConfig(
+        name=name,
+        version=Version(version),
+        library=True,
+        dependencies={dep_name: NpmSpec(dep_version) for dep_name, dep_version in dependencies.items()},
+    )
+    return CodeQLPack(path=Path("/packs") / name / version / "qlpack.yml", config=config)
+
+
+class BuildPackResolverTest(unittest.TestCase):
+    def test_resolves_dependency_to_highest_matching_version(self):
+        packs = [
+            create_pack("test/a", "1.2.0"),
+            create_pack("test/a", "2.0.0"),
+            create_pack("test/a", "1.0.0"),
+            create_pack("test/b", dependencies={"test/a": "^1.0.0"}),
+        ]
+        resolve = build_pack_resolver(packs)
+        resolved_pack = resolve(packs[3])
+        self.assertEqual([dep.config.version for dep in resolved_pack.dependencies], [Version("1.2.0")])
+        self.assertIs(resolved_pack.dependencies[0], resolve(packs[0]))
+
+    def test_resolves_dependency_on_bundle_pack(self):
+        bundle_packs = [create_pack("codeql/util"), create_pack("codeql/cpp-all", dependencies={"codeql/util": "*"})]
+        resolve_bundle_pack = build_pack_resolver(bundle_packs)
+        resolved_bundle_packs = [resolve_bundle_pack(pack) for pack in bundle_packs]
+
+        workspace_pack = create_pack("test/a", dependencies={"codeql/cpp-all": "*"})
+        resolve = build_pack_resolver([workspace_pack], resolved_bundle_packs)
+        resolved_pack = resolve(workspace_pack)
+        self.assertEqual(resolved_pack.kind, CodeQLPackKind.LIBRARY_PACK)
+        self.assertEqual(len(resolved_pack.dependencies), 1)
+        self.assertIs(resolved_pack.dependencies[0], resolved_bundle_packs[1])
+        self.assertIs(resolved_pack.dependencies[0].dependencies[0], resolved_bundle_packs[0])
+
+    def test_raises_for_self_dependency(self):
+        with self.assertRaisesRegex(PackResolverException, "test/a@0.0.1 \\(transitively\\) depends on itself"):
+            build_pack_resolver([create_pack("test/a", dependencies={"test/a": "*"})])
+
+    def test_raises_for_cyclic_dependency(self):
+        packs = [
+            create_pack("test/a", dependencies={"test/b": "*"}),
+            create_pack("test/b", dependencies={"test/c": "*"}),
+            create_pack("test/c", dependencies={"test/a": "*"}),
+        ]
+        with self.assertRaisesRegex(PackResolverException, "depends on itself"):
+            build_pack_resolver(packs)
+
+    def test_raises_for_missing_dependency(self):
+        packs = [create_pack("test/a", "0.0.1"), create_pack("test/b", dependencies={"test/a": "^1.0.0"})]
+        with self.assertRaisesRegex(PackResolverException, "Could not resolve dependency test/a@\\^1.0.0 for pack test/b@0.0.1"):
+            build_pack_resolver(packs)
+
+
+class PackDependencyGraphTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.packs = {
+            name: ResolvedCodeQLPack(
+                path=Path("/packs") / name / "qlpack.yml",
+                config=CodeQLPackConfig(name=name, library=True),
+                kind=CodeQLPackKind.LIBRARY_PACK,
+                pack_id=pack_id,
+            )
+            for pack_id, name in enumerate(["test/a", "test/b", "test/c", "test/d", "test/e"])
+        }
+
+    def static_order(self, graph: PackDependencyGraph) -> List[List[str]]:
+        return [[pack.config.name for pack in level] for level in graph.static_order()]
+
+    def test_orders_packs_in_levels(self):
+        a, b, c, d, e = self.packs.values()
+        graph = PackDependencyGraph()
+        # d depends on b and c, which both depend on a. e depends on a and d.
+        graph.add(d, b, c)
+        graph.add(e, a, d)
+        graph.add(b, a)
+        graph.add(c, a)
+        self.assertEqual(self.static_order(graph), [["test/a"], ["test/b", "test/c"], ["test/d"], ["test/e"]])
+
+    def test_orders_independent_packs_in_the_order_they_are_added(self):
+        a, b, c, _, _ = self.packs.values()
+        graph = PackDependencyGraph()
+        graph.add(c)
+        graph.add(a)
+        graph.add(b)
+        self.assertEqual(self.static_order(graph), [["test/c", "test/a", "test/b"]])
+
+    def test_counts_repeated_edges_once(self):
+        a, b, c, _, _ = self.packs.values()
+        graph = PackDependencyGraph()
+        graph.add(b, a)
+        graph.add(b, a, a)
+        graph.add(c, b)
+        self.assertIn(a, graph)
+        self.assertEqual(self.static_order(graph), [["test/a"], ["test/b"], ["test/c"]])
+
+    def test_raises_for_cyclic_dependency(self):
+        a, b, c, d, _ = self.packs.values()
+        graph = PackDependencyGraph()
+        graph.add(b, a)
+        graph.add(c, b)
+        graph.add(d, c)
+        graph.add(b, d)
+        with self.assertRaisesRegex(BundleException, "packs test/b, test/c, test/d have a cyclic dependency"):
+            graph.static_order()
+
+    def test_raises_for_self_dependency(self):
+        a, _, _, _, _ = self.packs.values()
+        graph = PackDependencyGraph()
+        graph.add(a, a)
+        with self.assertRaisesRegex(BundleException, "packs test/a have a cyclic dependency"):
+            graph.static_order()
+
+
+class ReplaceDependenciesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def create_pack(self, qlpack_yml: str) -> ResolvedCodeQLPack:
+        path = Path(self.tmp_dir.name) / "qlpack.yml"
+        path.write_text(qlpack_yml)
+        return ResolvedCodeQLPack(path=path, config=CodeQLPackConfig(name="test/pack"), kind=CodeQLPackKind.LIBRARY_PACK, pack_id=0)
+
+    def test_replaces_dependencies_block(self):
+        pack = self.create_pack('name: test/pack\ndependencies:\n  a/b: "*"\n  c/d: "*"\nlibrary: true\n')
+        self.assertEqual(replace_dependencies(pack, {}), "name: test/pack\ndependencies: {}\nlibrary: true\n")
+
+    def test_replaces_blank_and_comment_lines_between_dependencies(self):
+        pack = self.create_pack('dependencies:\n  a/b: "*"\n\n# The next dependency.\n  c/d: "*"\nlibrary: true\n')
+        self.assertEqual(replace_dependencies(pack, {"e/f": "1.0.0"}), "dependencies:\n  e/f: 1.0.0\nlibrary: true\n")
+
+    def test_keeps_blank_and_comment_lines_after_dependencies(self):
+        pack = self.create_pack(
+            'dependencies:\n  a/b: "*"\n\n# Pack is a library used by the tests below.\nlibrary: true\n'
+        )
+        self.assertEqual(
+            replace_dependencies(pack, {}),
+            "dependencies: {}\n\n# Pack is a library used by the tests below.\nlibrary: true\n",
+        )
+
+    def test_replaces_dependencies_block_at_end_of_file(self):
+        pack = self.create_pack('library: true\ndependencies:\n  a/b: "*"')
+        self.assertEqual(replace_dependencies(pack, {}), "library: true\ndependencies: {}\n")
+
+    def test_falls_back_when_dependencies_are_not_an_indented_mapping(self):
+        pack = self.create_pack('dependencies:\n- a/b\nlibrary: true\n')
+        self.assertEqual(replace_dependencies(pack, {}), "dependencies: {}\nlibrary: true\n")
+
+        pack = self.create_pack('dependencies:\n  - a/b\nlibrary: true\n')
+        self.assertEqual(replace_dependencies(pack, {}), "dependencies: {}\nlibrary: true\n")
+
+
+class ReadBundleArchiveTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = Path(tmp_dir.name)
+
+    def extract(self, bundle_path: Path) -> None:
+        with read_bundle_archive(bundle_path) as archive:
+            archive.extractall(self.tmp_path / "extracted")
+
+    def test_extracts_archive(self):
+        (self.tmp_path / "codeql").mkdir()
+        (self.tmp_path / "codeql" / "codeql").write_text("codeql")
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        with tarfile.open(bundle_path, "w:gz") as archive:
+            archive.add(self.tmp_path / "codeql", arcname="codeql")
+        self.extract(bundle_path)
+        self.assertEqual((self.tmp_path / "extracted" / "codeql" / "codeql").read_text(), "codeql")
+
+    def test_extracts_archive_with_padding_after_end_of_archive(self):
+        # Archives created with a large blocking factor (e.g., 'tar -b 2048') are padded well beyond what fits in a pipe.
+        archive_bytes = io.BytesIO()
+        with tarfile.open(fileobj=archive_bytes, mode="w") as archive:
+            member = tarfile.TarInfo("codeql/codeql")
+            member.size = len(b"codeql")
+            archive.addfile(member, io.BytesIO(b"codeql"))
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        bundle_path.write_bytes(gzip.compress(archive_bytes.getvalue() + bytes(4 << 20), compresslevel=1))
+        self.extract(bundle_path)
+        self.assertEqual((self.tmp_path / "extracted" / "codeql" / "codeql").read_text(), "codeql")
+
+    @unittest.skipUnless(hasattr(tarfile, "data_filter"), "requires tarfile extraction filters")
+    def test_propagates_extraction_filter_errors(self):
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        with tarfile.open(bundle_path, "w:gz") as archive:
+            member = tarfile.TarInfo("../outside")
+            archive.addfile(member, io.BytesIO())
+        with self.assertRaises(tarfile.FilterError):
+            with read_bundle_archive(bundle_path) as archive:
+                archive.extractall(self.tmp_path / "extracted", filter="data")
+
+    @unittest.skipIf(os.name == "nt", "requires a shell script as decompressor")
+    def test_reports_exit_status_of_failing_decompressor(self):
+        (self.tmp_path / "codeql").mkdir()
+        (self.tmp_path / "codeql" / "codeql").write_text("codeql")
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        with tarfile.open(bundle_path, "w") as archive:
+            archive.add(self.tmp_path / "codeql", arcname="codeql")
+        # Outputs the (uncompressed) archive and then fails without an error message.
+        decompressor_path = self.tmp_path / "decompressor"
+        decompressor_path.write_text('#!/bin/sh\ncat "$2"\nexit 1\n')
+        decompressor_path.chmod(0o755)
+        with mock.patch("codeql_bundle.helpers.bundle.shutil.which", return_value=str(decompressor_path)):
+            with self.assertRaises(BundleException) as context:
+                self.extract(bundle_path)
+        self.assertTrue(str(context.exception).endswith("with exit status 1"), str(context.exception))
+
+    def test_raises_bundle_exception_for_corrupt_archive(self):
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        bundle_path.write_bytes(b"This is not a gzip compressed tar archive.")
+        with self.assertRaises(BundleException):
+            self.extract(bundle_path)
+
+    def test_raises_bundle_exception_for_corrupt_archive_without_decompressor(self):
+        bundle_path = self.tmp_path / "codeql-bundle.tar.gz"
+        bundle_path.write_bytes(b"This is not a gzip compressed tar archive.")
+        with mock.patch("codeql_bundle.helpers.bundle.shutil.which", return_value=None):
+            with self.assertRaises(BundleException):
+                self.extract(bundle_path)
+
+
+class CreatePlatformBundleTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = Path(tmp_dir.name)
+        self.bundle_path = self.tmp_path / "bundle"
+        for file in [
+            "codeql",
+            "codeql.exe",
+            "tools/linux64/java",
+            "tools/osx64/java",
+            "tools/win64/java.exe",
+            "cpp/tools/linux/extractor",
+            "cpp/tools/macos/extractor",
+            "cpp/tools/windows/extractor.exe",
+            "cpp/tools/autobuild.sh",
+            "swift/qltest/linux64/qltest",
+            "swift/qltest/osx64/qltest",
+            "swift/resource-dir/linux64/resource",
+            "swift/resource-dir/osx64/resource",
+            "swift/tools/linux64/extractor",
+            "qlpacks/codeql/cpp-all/0.0.1/qlpack.yml",
+        ]:
+            (self.bundle_path / file).parent.mkdir(parents=True, exist_ok=True)
+            (self.bundle_path / file).write_text(file)
+
+    def get_member_names(self, bundle_path: Path, platform: BundlePlatform) -> List[str]:
+        output_path = self.tmp_path / f"{bundle_path.name}-{platform}.tar"
+        create_platform_bundle(bundle_path, {"cpp", "swift"}, output_path, platform, compression=BundleCompression.NONE)
+        with tarfile.open(output_path) as archive:
+            return archive.getnames()
+
+    def test_creates_same_bundle_from_directory_and_archive(self):
+        archive_path = self.tmp_path / "codeql-bundle.tar"
+        with open_bundle_archive(archive_path, compression=BundleCompression.NONE) as archive:
+            archive.add(self.bundle_path, arcname="codeql")
+
+        for platform in BundlePlatform:
+            with self.subTest(platform=platform):
+                self.assertEqual(
+                    self.get_member_names(self.bundle_path, platform), self.get_member_names(archive_path, platform)
+                )
+
+    def test_only_includes_files_for_platform(self):
+        def get_files(platform: BundlePlatform) -> set[str]:
+            with tarfile.open(self.tmp_path / f"bundle-{platform}.tar") as archive:
+                return {member.name.removeprefix("codeql/") for member in archive if member.isfile()}
+
+        for platform in BundlePlatform:
+            self.get_member_names(self.bundle_path, platform)
+        self.assertEqual(
+            get_files(BundlePlatform.LINUX),
+            {
+                "codeql",
+                "tools/linux64/java",
+                "cpp/tools/linux/extractor",
+                "cpp/tools/autobuild.sh",
+                "swift/qltest/linux64/qltest",
+                "swift/resource-dir/linux64/resource",
+                "swift/tools/linux64/extractor",
+                "qlpacks/codeql/cpp-all/0.0.1/qlpack.yml",
+            },
+        )
+        self.assertEqual(
+            get_files(BundlePlatform.OSX),
+            {
+                "codeql",
+                "tools/osx64/java",
+                "cpp/tools/macos/extractor",
+                "cpp/tools/autobuild.sh",
+                "swift/qltest/osx64/qltest",
+                "swift/resource-dir/osx64/resource",
+                "qlpacks/codeql/cpp-all/0.0.1/qlpack.yml",
+            },
+        )
+        self.assertEqual(
+            get_files(BundlePlatform.WINDOWS),
+            {
+                "codeql",
+                "codeql.exe",
+                "tools/win64/java.exe",
+                "cpp/tools/windows/extractor.exe",
+                "cpp/tools/autobuild.sh",
+                "qlpacks/codeql/cpp-all/0.0.1/qlpack.yml",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()